@@ -1,15 +1,65 @@
+import asyncio
+import os
 import pandas as pd
 import numpy as np
+from io import BytesIO
 
-def etl():
-    url1 = "https://raw.githubusercontent.com/MoH-Malaysia/data-darah-public/main/donations_facility.csv"
-    url2 = "https://raw.githubusercontent.com/MoH-Malaysia/data-darah-public/main/donations_state.csv"
-    url3 = "https://raw.githubusercontent.com/MoH-Malaysia/data-darah-public/main/newdonors_facility.csv"
-    url4 = "https://raw.githubusercontent.com/MoH-Malaysia/data-darah-public/main/newdonors_state.csv"
+from validate import validate_dataset
 
-    donate_fac = pd.read_csv(url1).to_json(orient="records")
-    donate_state = pd.read_csv(url2).to_json(orient="records")
-    new_donors_fac = pd.read_csv(url3).to_json(orient="records")
-    new_donors_state = pd.read_csv(url4).to_json(orient="records")
+BASE_URL = "https://raw.githubusercontent.com/MoH-Malaysia/data-darah-public/main"
 
-    return donate_fac, donate_state, new_donors_fac, new_donors_state
+# Replay mode: read <SNAPSHOT_DIR>/<YYYY-MM-DD>/<dataset>.csv|.parquet instead of GitHub
+SNAPSHOT_DIR = os.environ.get("SNAPSHOT_DIR")
+SNAPSHOT_DATE = os.environ.get("SNAPSHOT_DATE")
+
+# payload key: (file name, entity column, required columns)
+DATASETS = {
+    "donate_fac": ("donations_facility.csv", "hospital", ["date", "hospital", "daily"]),
+    "donate_state": ("donations_state.csv", "state",
+                     ["date", "state", "daily", "blood_a", "blood_b", "blood_o", "blood_ab", "donations_regular"]),
+    "new_donors_fac": ("newdonors_facility.csv", "hospital", ["date", "hospital"]),
+    "new_donors_state": ("newdonors_state.csv", "state", ["date", "state"]),
+}
+
+
+def latest_snapshot():
+    if SNAPSHOT_DATE:
+        return SNAPSHOT_DATE
+    snapshots = sorted(entry for entry in os.listdir(SNAPSHOT_DIR)
+                       if os.path.isdir(os.path.join(SNAPSHOT_DIR, entry)))
+    return snapshots[-1] if snapshots else None
+
+
+def read_snapshot(file_name):
+    stem = os.path.splitext(file_name)[0]
+    snapshot = os.path.join(SNAPSHOT_DIR, latest_snapshot())
+    for candidate in (f"{stem}.parquet", file_name):
+        path = os.path.join(snapshot, candidate)
+        if os.path.exists(path):
+            with open(path, 'rb') as file:
+                return file.read()
+    raise FileNotFoundError(f"{file_name} not found in snapshot {snapshot}")
+
+
+async def download(client, name):
+    file_name = DATASETS[name][0]
+    if SNAPSHOT_DIR:
+        return await asyncio.to_thread(read_snapshot, file_name)
+
+    response = await client.get(f"{BASE_URL}/{file_name}")
+    response.raise_for_status()
+    return response.content
+
+
+def read_raw(raw):
+    if raw[:4] == b"PAR1":
+        return pd.read_parquet(BytesIO(raw), engine='pyarrow')
+    return pd.read_csv(BytesIO(raw))
+
+
+def etl(name, raw, previous=None, accept_regression=False):
+    # CPU bound, run in a worker thread by the pipeline
+    _, entity, columns = DATASETS[name]
+    df = read_raw(raw)
+    df, max_date = validate_dataset(name, df, entity, columns, previous, accept_regression)
+    return df.to_json(orient="records", date_format="iso"), max_date, len(df)
@@ -1,23 +1,59 @@
-import requests
-import time
+import asyncio
 import os
 import logging
-from etl import etl
+import signal
+import httpx
+from etl import DATASETS, SNAPSHOT_DIR, download, etl, latest_snapshot
+from validate import (DatasetRegressionError, DatasetValidationError, accepted_regressions,
+                      check_row_counts, changed_datasets, fingerprint, load_state,
+                      record_rejection, save_state)
 
-API_URL = "http://telebot:8001/etl/"
+API_URL = os.environ.get("BOT_API_URL", "http://telebot:8001/etl/")
 GITHUB_REPO = "MoH-Malaysia/data-darah-public"
-LAST_SEEN_COMMIT = "last_seen_commit.txt"
+STATE_DIR = os.environ.get("STATE_DIR", ".")
+LAST_SEEN_COMMIT = os.path.join(STATE_DIR, "last_seen_commit.txt")
+DATASET_STATE = os.path.join(STATE_DIR, "dataset_state.json")
+REJECTED_DATASETS = os.path.join(STATE_DIR, "rejected_datasets.json")
+REJECTED_COMMIT = os.path.join(STATE_DIR, "rejected_commit.txt")
+# Comma separated dataset names (or "all") whose shrinking row count or
+# earlier latest date is accepted as the new baseline
+ACCEPT_DATASET_REGRESSION = os.environ.get("ACCEPT_DATASET_REGRESSION", "")
+# The same regressed file is accepted anyway after this many rejections
+REGRESSION_ACCEPT_AFTER = int(os.environ.get("REGRESSION_ACCEPT_AFTER", 3))
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+NO_DATASET_CHANGE = "New commit found, but no tracked dataset changed. Skipping ETL."
+
+# Seconds between commit checks; 0 checks once and exits
+POLL_INTERVAL = int(os.environ.get("POLL_INTERVAL", 0))
+HTTP_TIMEOUT = httpx.Timeout(30.0, read=120.0)
+# The /etl/ trigger answers only after the whole report has been sent
+TRIGGER_TIMEOUT = httpx.Timeout(30.0, read=float(os.environ.get("TRIGGER_READ_TIMEOUT", 1800)))
+# Upper bound for downloading, validating and shipping one commit
+COMMIT_TIMEOUT = int(os.environ.get("COMMIT_TIMEOUT", 900))
+
+# Outcomes of post_to_bot
+NOT_SENT = "not sent"
+ACCEPTED = "accepted"
+FAILED = "failed after sending"
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
-def get_latest_commit():
+class BotUploadError(Exception):
+    pass
+
+async def get_latest_commit(client):
+    if SNAPSHOT_DIR:
+        snapshot = latest_snapshot()
+        return f"snapshot-{snapshot}" if snapshot else None
+
     url = f"https://api.github.com/repos/{GITHUB_REPO}/commits"
     try:
-        response = requests.get(url)
+        response = await client.get(url)
+        response.raise_for_status()
         commits = response.json()
         return commits[0]['sha'] if commits else None
-    except requests.RequestException as e:
+    except httpx.HTTPError as e:
         logging.error(f"Error fetching latest commit: {e}")
         return None
 
@@ -33,39 +69,199 @@ def update_last_seen_commit(commit):
     with open(LAST_SEEN_COMMIT, 'w') as file:
         file.write(commit)
 
-def collect_data():
-    while True:
-        latest_commit = get_latest_commit()
-        if latest_commit and has_new_commit(latest_commit):
-            update_last_seen_commit(latest_commit)
-            donate_fac, donate_state, new_donors_fac, new_donors_state = etl()
-            message = "New commit found. Triggering ETL process."
-            return message, donate_fac, donate_state, new_donors_fac, new_donors_state
-        else:
-            return "No new commits. Checking again later.", None, None, None, None 
-
-def send_data_to_bot(message, donate_fac, donate_state, new_donors_fac, new_donors_state, max_retries=5, delay=5):
+def was_rejected(commit):
+    if not os.path.exists(REJECTED_COMMIT):
+        return False
+
+    with open(REJECTED_COMMIT, 'r') as file:
+        return file.read().strip() == commit
+
+def update_rejected_commit(commit):
+    with open(REJECTED_COMMIT, 'w') as file:
+        file.write(commit)
+
+async def post_to_bot(client, url, payload, max_retries=5, delay=5, idempotent=True, timeout=HTTP_TIMEOUT):
+    # Returns NOT_SENT if no attempt reached the bot, ACCEPTED on a 200 and
+    # FAILED if the bot got the request but did not answer with a 200. A
+    # non-idempotent request is only retried while it has not reached the bot.
+    outcome = NOT_SENT
     for attempt in range(max_retries):
         try:
-            payload = {
-                "message": message,
-                "donate_fac": donate_fac,
-                "donate_state": donate_state,
-                "new_donors_fac": new_donors_fac,
-                "new_donors_state": new_donors_state}
-            response = requests.post(API_URL, json=payload)
+            response = await client.post(url, json=payload, timeout=timeout)
             if response.status_code == 200:
-                logging.info("Message from pipeline sent successfully")
-                return
-            else:
-                logging.error(f"Failed to send message, status code {response.status_code}")
-        except requests.exceptions.ConnectionError as e:
+                return ACCEPTED
+            logging.error(f"Failed to send to {url}, status code {response.status_code}")
+            outcome = FAILED
+            if not idempotent:
+                return outcome
+        except (httpx.ConnectError, httpx.ConnectTimeout) as e:
             logging.error(f"Attempt {attempt + 1} failed with error: {e}. Retrying in {delay} seconds...")
+        except httpx.TransportError as e:
+            outcome = FAILED
+            if not idempotent:
+                logging.error(f"Request to {url} failed after it was sent, not retrying: {e!r}")
+                return outcome
+            logging.error(f"Attempt {attempt + 1} failed with error: {e}. Retrying in {delay} seconds...")
+
+        await asyncio.sleep(delay)
+
+    return outcome
+
+async def send_data_to_bot(client, message, commit=None):
+    payload = {"message": message}
+    if commit:
+        payload["commit"] = commit
+    # The bot posts the message (and for a commit the whole report) before
+    # it answers, so a request that got through must not be sent again
+    outcome = await post_to_bot(client, API_URL, payload, idempotent=False, timeout=TRIGGER_TIMEOUT)
+    if outcome == ACCEPTED:
+        logging.info("Message from pipeline sent successfully")
+    elif outcome == NOT_SENT:
+        logging.error("Failed to connect to the Telegram bot service.")
+    else:
+        logging.error("The Telegram bot service received the message but failed to handle it.")
+    return outcome
 
-        time.sleep(delay)
+async def wait_for_any(*events):
+    waiters = [asyncio.create_task(event.wait()) for event in events]
+    try:
+        await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for waiter in waiters:
+            waiter.cancel()
+
+async def ship_datasets(client, commit, previous_state, rejected):
+    # Every dataset is downloaded, hashed, parsed and uploaded on its own, so
+    # the first one to finish is on its way to the bot while the others are
+    # still downloading. Unchanged datasets are only parsed once another
+    # dataset is known to have changed.
+    loop = asyncio.get_running_loop()
+    fingerprints = {}
+    max_dates = {}
+    any_changed = asyncio.Event()
+    all_fingerprinted = asyncio.Event()
+
+    async def ship(name):
+        raw = await download(client, name)
+        fp = await loop.run_in_executor(None, fingerprint, raw)
+        accepted = accepted_regressions({name: fp}, rejected, ACCEPT_DATASET_REGRESSION, REGRESSION_ACCEPT_AFTER)
+        try:
+            check_row_counts({name: fp}, previous_state, accepted)
+            fingerprints[name] = fp
+            if changed_datasets({name: fp}, previous_state):
+                any_changed.set()
+            if len(fingerprints) == len(DATASETS):
+                all_fingerprinted.set()
 
-    logging.error("Failed to connect to the Telegram bot service.")
+            await wait_for_any(any_changed, all_fingerprinted)
+            if not any_changed.is_set():
+                return
+
+            data, max_dates[name], rows = await loop.run_in_executor(
+                None, etl, name, raw, previous_state.get(name), name in accepted
+            )
+            # The baseline is the row count after duplicates were dropped, the
+            # raw count of a valid file never falls below it
+            fingerprints[name] = {**fp, "rows": rows}
+        except DatasetRegressionError as e:
+            e.sha256 = fp["sha256"]
+            raise
+        del raw
+        if await post_to_bot(client, f"{API_URL}{commit}/{name}", {"data": data}) != ACCEPTED:
+            raise BotUploadError(f"Could not upload {name} to the bot")
+        logging.info(f"Shipped {name} for commit {commit}")
+
+    try:
+        async with asyncio.timeout(COMMIT_TIMEOUT):
+            async with asyncio.TaskGroup() as group:
+                for name in DATASETS:
+                    group.create_task(ship(name))
+    except ExceptionGroup as group:
+        # The remaining downloads were cancelled, report the first failure
+        raise group.exceptions[0]
+
+    return fingerprints, (max_dates if any_changed.is_set() else None)
+
+async def check_for_updates(client):
+    latest_commit = await get_latest_commit(client)
+    if not (latest_commit and has_new_commit(latest_commit)):
+        message = "No new commits. Checking again later."
+        logging.info(message)
+        if not POLL_INTERVAL:
+            await send_data_to_bot(client, message)
+        return
+
+    previous_state = load_state(DATASET_STATE)
+    rejected = load_state(REJECTED_DATASETS)
+    try:
+        fingerprints, max_dates = await ship_datasets(client, latest_commit, previous_state, rejected)
+    except DatasetValidationError as e:
+        logging.error(f"Dataset {e.name} rejected for commit {latest_commit}: {e}")
+        message = f"Dataset validation failed, skipping ETL: {e}"
+        if isinstance(e, DatasetRegressionError):
+            count = record_rejection(rejected, e.name, e.sha256)
+            save_state(REJECTED_DATASETS, rejected)
+            logging.info(f"{e.name} rejected {count}/{REGRESSION_ACCEPT_AFTER} times with this file")
+            message += (f" (accepted automatically once the same file was rejected {REGRESSION_ACCEPT_AFTER} times,"
+                        f" set ACCEPT_DATASET_REGRESSION={e.name} to accept it now)")
+        # A rejected commit is checked again on every poll, so a regressed
+        # file gets accepted after REGRESSION_ACCEPT_AFTER polls, but the
+        # group is only told about it once
+        if was_rejected(latest_commit):
+            return
+        update_rejected_commit(latest_commit)
+        await send_data_to_bot(client, message)
+        return
+    except Exception:
+        # Malformed files surface as pandas/pyarrow errors; log them and
+        # keep polling rather than ending the service
+        logging.exception(f"ETL failed for commit {latest_commit}")
+        return
+
+    if max_dates is None:
+        logging.info(NO_DATASET_CHANGE)
+        update_last_seen_commit(latest_commit)
+        return
+
+    outcome = await send_data_to_bot(client, "New commit found. Triggering ETL process.", latest_commit)
+    if outcome == NOT_SENT:
+        return
+
+    # Once the trigger reached the bot part or all of the report may have been
+    # posted, so the commit is never triggered again even if the bot failed
+    update_last_seen_commit(latest_commit)
+    if outcome == ACCEPTED:
+        save_state(DATASET_STATE, {
+            name: {**fp, "max_date": max_dates[name].strftime("%Y-%m-%d")}
+            for name, fp in fingerprints.items()
+        })
+        save_state(REJECTED_DATASETS, {})
+
+async def main():
+    loop = asyncio.get_running_loop()
+    main_task = asyncio.current_task()
+    loop.add_signal_handler(signal.SIGTERM, main_task.cancel)
+
+    async with httpx.AsyncClient(timeout=HTTP_TIMEOUT) as client:
+        while True:
+            try:
+                await check_for_updates(client)
+            except Exception:
+                logging.exception("Checking for updates failed")
+            if not POLL_INTERVAL:
+                return
+            await asyncio.sleep(POLL_INTERVAL)
+
+def run():
+    try:
+        asyncio.run(main())
+    except asyncio.CancelledError:
+        logging.info("Pipeline stopped.")
 
 if __name__ == "__main__":
-    message, donate_fac, donate_state, new_donors_fac, new_donors_state = collect_data()
-    send_data_to_bot(message, donate_fac, donate_state, new_donors_fac, new_donors_state)
+    if PROFILE_DIR:
+        import cProfile
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        cProfile.run("run()", os.path.join(PROFILE_DIR, "pipeline.prof"))
+    else:
+        run()
@@ -0,0 +1,124 @@
+import hashlib
+import json
+import logging
+import os
+from io import BytesIO
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+
+class DatasetValidationError(ValueError):
+    def __init__(self, name, message):
+        super().__init__(f"{name}: {message}")
+        self.name = name
+
+
+# The file shrank or its latest date moved backwards. Usually a partial
+# upload, but upstream may also have removed rows on purpose, so the
+# pipeline can accept it as the new baseline.
+class DatasetRegressionError(DatasetValidationError):
+    pass
+
+
+def fingerprint(raw):
+    # Cheap enough to run on every commit: no CSV parsing involved. The raw
+    # row count still includes duplicates, the pipeline saves the count
+    # after validate_dataset as the baseline.
+    if raw[:4] == b"PAR1":
+        rows = pq.read_metadata(BytesIO(raw)).num_rows
+    else:
+        rows = raw.count(b"\n")
+    return {
+        "sha256": hashlib.sha256(raw).hexdigest(),
+        "rows": rows,
+    }
+
+
+def load_state(path):
+    if not os.path.exists(path):
+        return {}
+
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def save_state(path, state):
+    with open(path, 'w') as file:
+        json.dump(state, file, indent=2)
+
+
+def accepted_regressions(fingerprints, rejected, accept_setting, accept_after):
+    # A regression is accepted when ACCEPT_DATASET_REGRESSION names the
+    # dataset (or is "all"), or when the very same file has already been
+    # rejected accept_after times in a row
+    names = {name.strip() for name in accept_setting.split(",") if name.strip()}
+    return {
+        name for name, fp in fingerprints.items()
+        if "all" in names or name in names
+        or (rejected.get(name, {}).get("sha256") == fp["sha256"]
+            and rejected[name]["count"] >= accept_after)
+    }
+
+
+def record_rejection(rejected, name, sha256):
+    previous = rejected.get(name, {})
+    count = previous.get("count", 0) + 1 if previous.get("sha256") == sha256 else 1
+    rejected[name] = {"sha256": sha256, "count": count}
+    return count
+
+
+def changed_datasets(fingerprints, previous_state):
+    return [
+        name for name, fp in fingerprints.items()
+        if previous_state.get(name, {}).get("sha256") != fp["sha256"]
+    ]
+
+
+def check_row_counts(fingerprints, previous_state, accepted=()):
+    # Runs before parsing so a truncated download is rejected cheaply
+    for name, fp in fingerprints.items():
+        previous_rows = previous_state.get(name, {}).get("rows")
+        if previous_rows is not None and fp["rows"] < previous_rows:
+            if name in accepted:
+                logging.warning(f"{name}: accepting {fp['rows']} rows as new baseline, previously {previous_rows}")
+                continue
+            raise DatasetRegressionError(name, f"{fp['rows']} rows, previously {previous_rows}")
+
+
+def validate_dataset(name, df, entity, columns, previous=None, accept_regression=False):
+    missing = [column for column in columns if column not in df.columns]
+    if missing:
+        raise DatasetValidationError(name, f"missing columns {missing}")
+
+    incomplete = df[columns].isna().any(axis=1)
+    if incomplete.any():
+        raise DatasetValidationError(name, f"{incomplete.sum()} rows with empty required fields")
+
+    # Parse separately so the original date strings are what gets shipped
+    dates = pd.to_datetime(df["date"], errors="coerce")
+    if dates.isna().any():
+        raise DatasetValidationError(name, f"{dates.isna().sum()} rows with unparseable dates")
+
+    keys = pd.DataFrame({"date": dates, entity: df[entity]})
+    duplicated = keys.duplicated(keep="last")
+    if duplicated.any():
+        logging.warning(f"{name}: dropping {duplicated.sum()} duplicate (date, {entity}) rows")
+        df = df[~duplicated.values]
+        keys = keys[~duplicated.values]
+
+    keys = keys.sort_values([entity, "date"])
+    gaps = keys.groupby(entity)["date"].diff() > pd.Timedelta(days=1)
+    if gaps.any():
+        logging.warning(
+            f"{name}: {gaps.sum()} date gaps across {keys.loc[gaps, entity].nunique()} {entity} series"
+        )
+
+    max_date = keys["date"].max()
+    if previous and "max_date" in previous and max_date < pd.Timestamp(previous["max_date"]):
+        message = f"latest date {max_date.date()} is older than previously seen {previous['max_date']}"
+        if not accept_regression:
+            raise DatasetRegressionError(name, message)
+        logging.warning(f"{name}: accepting as new baseline, {message}")
+
+    return df, max_date
@@ -0,0 +1,154 @@
+import numpy as np
+import pandas as pd
+
+BASELINE_WINDOW = 28
+Z_THRESHOLD = 2.0
+MIN_EXPECTED_WEEKLY = 20
+
+
+def donation_matrix(df, col_name, value_col="daily"):
+    # Scatter the long data into a (day x entity) matrix covering every
+    # calendar day, leaving missing observations as NaN
+    dates = df["date"].values.astype("datetime64[D]")
+    entity_idx, entities = pd.factorize(df[col_name], sort=True)
+    entities = np.asarray(entities)
+    first_day = dates.min()
+    day_idx = (dates - first_day).astype(np.int64)
+
+    matrix = np.full((day_idx.max() + 1, len(entities)), np.nan)
+    matrix[day_idx, entity_idx] = pd.to_numeric(df[value_col], errors="coerce").values
+    days = first_day + np.arange(matrix.shape[0])
+    return matrix, days, entities
+
+
+def trailing_stats(matrix, window=BASELINE_WINDOW):
+    # Mean and std of the `window` days strictly before each day, computed
+    # for all entities at once from cumulative sums
+    valid = ~np.isnan(matrix)
+    values = np.where(valid, matrix, 0.0)
+    zeros = np.zeros((1, matrix.shape[1]))
+    cum_sum = np.vstack([zeros, np.cumsum(values, axis=0)])
+    cum_sq = np.vstack([zeros, np.cumsum(values * values, axis=0)])
+    cum_count = np.vstack([zeros, np.cumsum(valid, axis=0)])
+
+    end = np.arange(matrix.shape[0])
+    start = np.maximum(end - window, 0)
+    count = cum_count[end] - cum_count[start]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        mean = (cum_sum[end] - cum_sum[start]) / count
+        var = (cum_sq[end] - cum_sq[start]) / count - mean * mean
+    std = np.sqrt(np.clip(var, 0, None))
+    mean[count < window // 2] = np.nan
+    return mean, std
+
+
+def day_of_week(days):
+    return (days.astype(np.int64) + 3) % 7  # 1970-01-01 was a Thursday
+
+
+def weekday_profile(matrix, weekdays, baseline):
+    # Average ratio of each weekday to the trailing baseline, per entity
+    with np.errstate(invalid="ignore", divide="ignore"):
+        ratio = matrix / baseline
+    ratio[~np.isfinite(ratio)] = np.nan
+
+    profile = np.ones((7, matrix.shape[1]))
+    for weekday in range(7):
+        rows = ratio[weekdays == weekday]
+        counts = (~np.isnan(rows)).sum(axis=0)
+        sums = np.nansum(rows, axis=0)
+        profile[weekday] = np.where(counts > 0, sums / np.maximum(counts, 1), 1.0)
+    return profile
+
+
+def detect_anomalies(df, col_name, days_back=7, window=BASELINE_WINDOW, z_threshold=Z_THRESHOLD):
+    matrix, days, entities = donation_matrix(df, col_name)
+    if matrix.shape[0] <= days_back + window:
+        return pd.DataFrame(columns=[col_name, "actual", "expected", "change", "z"])
+
+    mean, std = trailing_stats(matrix, window)
+    weekdays = day_of_week(days)
+    history = slice(None, -days_back)
+    profile = weekday_profile(matrix[history], weekdays[history], mean[history])
+
+    # Baseline is frozen at the start of the week so a bad week cannot drag
+    # its own expectation down
+    week_start = matrix.shape[0] - days_back
+    week = matrix[week_start:]
+    expected = mean[week_start] * profile[weekdays[week_start:]]
+    observed = ~np.isnan(week)
+
+    actual_sum = np.where(observed, week, 0.0).sum(axis=0)
+    expected_sum = np.where(observed, expected, 0.0).sum(axis=0)
+    spread = std[week_start] * np.sqrt(observed.sum(axis=0))
+    with np.errstate(invalid="ignore", divide="ignore"):
+        z = (actual_sum - expected_sum) / np.maximum(spread, 1.0)
+        change = actual_sum / expected_sum - 1
+
+    flagged = (z < -z_threshold) & (expected_sum >= MIN_EXPECTED_WEEKLY) & observed.any(axis=0)
+    anomalies = pd.DataFrame({
+        col_name: entities[flagged],
+        "actual": actual_sum[flagged],
+        "expected": expected_sum[flagged],
+        "change": change[flagged],
+        "z": z[flagged],
+    })
+    return anomalies.sort_values("z").reset_index(drop=True)
+
+
+def anomaly_message(donate_state, donate_fac):
+    # "Malaysia" is the national total, not a state
+    states = donate_state[donate_state['state'] != "Malaysia"]
+
+    sections = []
+    for label, df, col_name in [("States", states, "state"), ("Facilities", donate_fac, "hospital")]:
+        # Each dataset is scored over its own last seven days
+        latest_date = df['date'].max()
+        prev_week = latest_date - pd.Timedelta(days=6)
+        header = f"{label} [{prev_week.strftime('%d-%m-%Y')} - {latest_date.strftime('%d-%m-%Y')}]\n"
+
+        anomalies = detect_anomalies(df, col_name)
+        if anomalies.empty:
+            sections.append(f"{header}All within expected levels.\n")
+            continue
+        sections.append(
+            f"{header}Below expected levels:\n"
+            + "".join(
+                [
+                    f"{idx+1}. {row[col_name]}: {row['actual']:.0f} vs {row['expected']:.0f} expected ({row['change']:+.0%})\n"
+                    for idx, row in anomalies.iterrows()
+                ]
+            )
+        )
+
+    return "Donation Alerts\n\n" + "\n".join(sections)
+
+
+if __name__ == "__main__":
+    # Benchmark on synthetic full history: python anomaly.py [facilities] [years]
+    import sys
+    import time
+
+    num_entities = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    num_years = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(end="2024-06-30", periods=num_years * 365, freq="D")
+    level = rng.uniform(20, 400, num_entities)
+    weekly = 1 + 0.3 * np.sin(2 * np.pi * dates.dayofweek.values / 7)[:, None]
+    daily = rng.poisson(level[None, :] * weekly)
+    daily[-7:, :5] //= 3  # five facilities with a bad week
+    df = pd.DataFrame({
+        "date": np.repeat(dates.values, num_entities),
+        "hospital": np.tile([f"Facility {i:03d}" for i in range(num_entities)], len(dates)),
+        "daily": daily.ravel(),
+    })
+
+    runs = 5
+    start = time.perf_counter()
+    for _ in range(runs):
+        anomalies = detect_anomalies(df, "hospital")
+    elapsed = (time.perf_counter() - start) / runs
+
+    print(f"{num_entities} facilities x {len(dates)} days ({len(df):,} rows): {elapsed * 1000:.1f} ms per run")
+    print(anomalies)
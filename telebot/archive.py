@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+
+# Closed years never change, so their monthly sums, caption and rendered plot
+# are stored once under ARCHIVE_DIR/v<ARCHIVE_VERSION>/<year>/ and served from
+# there afterwards. Bump ARCHIVE_VERSION whenever the yearly plot changes.
+ARCHIVE_DIR = os.environ.get("ARCHIVE_DIR", "yearly_archive")
+ARCHIVE_VERSION = 1
+
+MONTHLY_SUMS = "monthly_sums.parquet"
+CAPTION = "caption.txt"
+PLOT = "plot.png"
+
+
+def year_path(year):
+    return os.path.join(ARCHIVE_DIR, f"v{ARCHIVE_VERSION}", str(year))
+
+
+def load_year(year):
+    path = year_path(year)
+    if not os.path.exists(os.path.join(path, PLOT)):
+        return None
+
+    with open(os.path.join(path, CAPTION), "r") as file:
+        caption = file.read()
+    with open(os.path.join(path, PLOT), "rb") as file:
+        plot = file.read()
+    return plot, caption
+
+
+def save_year(year, monthly_sums, caption, plot):
+    path = year_path(year)
+    if os.path.exists(path):
+        return
+
+    parent = os.path.dirname(path)
+    os.makedirs(parent, exist_ok=True)
+    # Build in a scratch directory and rename so a crash never leaves a
+    # half-written year behind
+    staging = tempfile.mkdtemp(dir=parent)
+    try:
+        monthly_sums.to_parquet(os.path.join(staging, MONTHLY_SUMS), engine="pyarrow")
+        with open(os.path.join(staging, CAPTION), "w") as file:
+            file.write(caption)
+        with open(os.path.join(staging, PLOT), "wb") as file:
+            file.write(plot)
+        os.replace(staging, path)
+    except OSError:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
@@ -1,28 +1,36 @@
 import os
 import logging
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, HTTPException, Request
 from contextlib import asynccontextmanager
-import pandas as pd
-from io import StringIO
 
-from process import create_image_and_captions, retent_transform
-from weekly_process import donation_amnt, donation_by_state, regular_donation_by_state, donation_by_facility
 from bot_send import send_telegram_message, try_send_three_times
+from worker import RenderWorker
 
 TOKEN = os.environ.get("TOKEN")
 GROUP_CHAT_ID = os.environ.get("GROUP_CHAT_ID")
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{TOKEN}"
+RETENTION_PATH = os.environ.get("RETENTION_PATH", "blood_donation_retention_2024.parquet")
 
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+render_worker = RenderWorker()
+
+# Datasets the pipeline uploads ahead of the /etl/ trigger, keyed by commit
+DATASETS = ("donate_fac", "donate_state", "new_donors_fac", "new_donors_state")
+MAX_PENDING_COMMITS = 2
+pending_datasets = {}
+# Commits whose report is being rendered, a repeated trigger is refused
+processing_commits = set()
+
 
 @asynccontextmanager
 async def app_lifespan(app: FastAPI):
     await send_telegram_message(GROUP_CHAT_ID, "Bot Initiated")
     yield
     logging.info("Application is shutting down.")
+    render_worker.shutdown()
 
 
 app = FastAPI(lifespan=app_lifespan)
@@ -33,59 +41,66 @@ async def health_check():
     return {"status": "healthy"}
 
 
+@app.post("/etl/{commit}/{dataset}")
+async def receive_dataset(commit: str, dataset: str, request: Request):
+    if dataset not in DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset {dataset}")
+
+    body = await request.json()
+    if commit not in pending_datasets:
+        pending_datasets[commit] = {}
+        # Drop uploads from commits whose trigger never arrived
+        stale = [pending for pending in pending_datasets if pending not in processing_commits]
+        for pending in stale[:max(len(pending_datasets) - MAX_PENDING_COMMITS, 0)]:
+            pending_datasets.pop(pending)
+    pending_datasets[commit][dataset] = body.get("data")
+    logging.info(f"Received {dataset} for commit {commit}")
+    return {"message": f"{dataset} received"}
+
+
 @app.post("/etl/")
 async def receive_etl(request: Request):
+    body = await request.json()
+    commit = body.get("commit")
+    if commit:
+        # Checked before anything is sent so a repeated or early trigger
+        # cannot post a partial report
+        if commit in processing_commits:
+            raise HTTPException(status_code=409, detail=f"Commit {commit} is already being processed")
+        uploads = pending_datasets.get(commit, {})
+        missing = [name for name in DATASETS if name not in uploads]
+        if missing:
+            logging.error(f"Trigger for commit {commit} is missing datasets {missing}")
+            raise HTTPException(status_code=409, detail=f"Missing datasets for commit {commit}: {missing}")
+        body = {**uploads, **body}
+        processing_commits.add(commit)
+
     try:
-        body = await request.json()
         message = body.get("message", "ERROR: Message not found.")
         await send_telegram_message(GROUP_CHAT_ID, message)
 
         if message == "New commit found. Triggering ETL process.":
 
-            donor_retent = pd.read_parquet('blood_donation_retention_2024.parquet', engine='pyarrow')
-            donor_retent['visit_date'] = pd.to_datetime(donor_retent['visit_date'])
-            donor_retent['birth_date'] = donor_retent['birth_date'].astype(int)
-            donor_retent_all_years_img, donor_retent_all_years_capt = retent_transform(donor_retent)
-            await try_send_three_times(GROUP_CHAT_ID, donor_retent_all_years_img, donor_retent_all_years_capt)
-            for year_range in [5, 1]: # send past 5 years trend and past year trend
-                donor_retent_year_range_img, donor_retent_year_range_capt = retent_transform(donor_retent, year_range)
-                await try_send_three_times(GROUP_CHAT_ID, donor_retent_year_range_img, donor_retent_year_range_capt)
-
-            donate_fac = pd.read_json(StringIO(body.get("donate_fac")), orient="records")
-            donate_fac['date'] = pd.to_datetime(donate_fac['date'])
-            latest_date = donate_fac['date'].max()
-            prev_week = latest_date - pd.Timedelta(days=6)
-            this_weeks_data = donate_fac[(donate_fac['date'] >= prev_week) & 
-                                                (donate_fac['date'] <= latest_date)].copy()
-            images_and_captions = create_image_and_captions(donate_fac)
+            images_and_captions = await render_worker.run("reports.retention_report", RETENTION_PATH)
             for image_and_caption in images_and_captions:
                 await try_send_three_times(GROUP_CHAT_ID, image_and_caption[0], image_and_caption[1])
-            donation_by_facility_img, donation_by_facility_capt = donation_by_facility(this_weeks_data)
-            await try_send_three_times(GROUP_CHAT_ID, donation_by_facility_img, donation_by_facility_capt)
 
-            donate_state = pd.read_json(
-                StringIO(body.get("donate_state")), orient="records"
-            )
-            donate_state['date'] = pd.to_datetime(donate_state['date'])
-            donation_amnt_img, donation_amnt_capt = donation_amnt(donate_state)
-            await try_send_three_times(GROUP_CHAT_ID, donation_amnt_img, donation_amnt_capt)
-            donation_by_state_img, donation_by_state_capt = donation_by_state(donate_state)
-            await try_send_three_times(GROUP_CHAT_ID, donation_by_state_img, donation_by_state_capt)
-            regular_donation_by_state_img, regular_donation_by_state_capt = regular_donation_by_state(donate_state)
-            await try_send_three_times(GROUP_CHAT_ID, regular_donation_by_state_img, regular_donation_by_state_capt)
-
-            new_donors_fac = pd.read_json(
-                StringIO(body.get("new_donors_fac")), orient="records"
+            images_and_captions, anomaly_message = await render_worker.run(
+                "reports.weekly_report", body.get("donate_fac"), body.get("donate_state")
             )
+            for image_and_caption in images_and_captions:
+                await try_send_three_times(GROUP_CHAT_ID, image_and_caption[0], image_and_caption[1])
+            await send_telegram_message(GROUP_CHAT_ID, anomaly_message)
 
-            new_donors_state = pd.read_json(
-                StringIO(body.get("new_donors_state")), orient="records"
-            )
+        if commit:
+            pending_datasets.pop(commit, None)
         logging.info(f"ETL received and processed: {message}")
         return {"message": "Notification sent to Telegram"}
     except Exception as e:
         logging.error(f"Error processing ETL: {e}")
         raise e
+    finally:
+        processing_commits.discard(commit)
 
 
 if __name__ == "__main__":
@@ -1,45 +1,38 @@
-import httpx
 import logging
 import os
 
+from sinks import make_sink
+
 TOKEN = os.environ.get("TOKEN")
 TELEGRAM_API_URL = f"https://api.telegram.org/bot{TOKEN}"
 
+sink = make_sink(os.environ.get("TELEGRAM_SINK"), TELEGRAM_API_URL)
+
 logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-async def send_telegram_message(chat_id, message):
-    json_msg = {"chat_id": chat_id, "text": message}
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{TELEGRAM_API_URL}/sendMessage", json=json_msg
-            )
-            response.raise_for_status()
-            logging.info("Message sent to Telegram successfully.")
-        except Exception as e:
-            logging.error(f"An error occurred while sending message to Telegram: {e}")
+def set_sink(new_sink):
+    global sink
+    sink = new_sink
 
 
-async def send_telegram_photo(chat_id, photo_stream, caption_text=None):
-    files = {"photo": ("plot.png", photo_stream)}
-    json_msg = {"chat_id": chat_id}
+async def send_telegram_message(chat_id, message):
+    try:
+        await sink.send_message(chat_id, message)
+        logging.info("Message sent to Telegram successfully.")
+    except Exception as e:
+        logging.error(f"An error occurred while sending message to Telegram: {e}")
 
-    if caption_text:
-        json_msg["caption"] = caption_text
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(
-                f"{TELEGRAM_API_URL}/sendPhoto", data=json_msg, files=files
-            )
-            response.raise_for_status()
-            logging.info("Photo with caption sent to Telegram successfully.")
-        except Exception as e:
-            logging.error(
-                f"An error occurred while sending photo with caption to Telegram: {e}"
-            )
+async def send_telegram_photo(chat_id, photo_stream, caption_text=None):
+    try:
+        await sink.send_photo(chat_id, photo_stream, caption_text)
+        logging.info("Photo with caption sent to Telegram successfully.")
+    except Exception as e:
+        logging.error(
+            f"An error occurred while sending photo with caption to Telegram: {e}"
+        )
 
 async def try_send_three_times(id, image, caption=None):
     attempts = 0
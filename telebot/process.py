@@ -1,9 +1,20 @@
+import os
 import pandas as pd
 import itertools
 import matplotlib.pyplot as plt
 from io import BytesIO
 from datetime import datetime
 
+from archive import load_year, save_year
+
+
+def current_year():
+    # REPORT_DATE pins "today" so replayed reports are reproducible
+    report_date = os.environ.get("REPORT_DATE")
+    if report_date:
+        return datetime.strptime(report_date, "%Y-%m-%d").year
+    return datetime.now().year
+
 
 def create_message(df, year):
     df["daily"] = pd.to_numeric(df["daily"], errors="coerce")
@@ -43,89 +54,113 @@ def create_message(df, year):
     return f"{decline_message}\n{increase_message}"
 
 
+def plot_year(monthly_sums, hospitals, year):
+    markers = itertools.cycle(("+", "o", "*", "s", "x", "D", "^"))
+    line_styles = itertools.cycle((":", "-.", "-"))
+
+    cmap = plt.get_cmap("gnuplot2")
+
+    plt.figure(figsize=(16, 8))
+
+    # Create the primary y-axis
+    ax1 = plt.gca()
+    ax1.set_ylabel("Blood Donations (Normal Range)")
+
+    # Create the secondary y-axis
+    ax2 = ax1.twinx()
+    ax2.set_ylabel("Blood Donations (Large Range)")
+
+    num_hospitals = len(hospitals)
+    hospitals_with_data = set(monthly_sums["hospital"])
+
+    for i, hospital in enumerate(hospitals):
+        color_index = i / (num_hospitals - 1) * 0.85
+
+        if hospital in hospitals_with_data:
+            monthly_data = monthly_sums[monthly_sums["hospital"] == hospital].set_index("date")
+        else:
+            monthly_data = pd.DataFrame({"daily": []}, index=pd.DatetimeIndex([]))
+
+        # Plotting for each hospital
+        if hospital == "Pusat Darah Negara":
+            # Plot on secondary y-axis
+            ax2.plot(
+                monthly_data.index.month,
+                monthly_data["daily"],
+                label=hospital + " (Large Range)",
+                color="red",
+                linestyle="-",
+                marker="x",
+            )
+        else:
+            # Plot on primary y-axis
+            ax1.plot(
+                monthly_data.index.month,
+                monthly_data["daily"],
+                label=hospital,
+                color=cmap(color_index),
+                marker=next(markers),
+                linestyle=next(line_styles),
+            )
+
+    # Plot settings
+    plt.title(f"Monthly Blood Donations in {year}")
+    plt.xlabel("Month")
+    ax1.set_xticks(range(1, 13))  # Set x-ticks to be each month
+    ax1.grid(True)
+
+    # Adjust primary axis legend (outside the plot)
+    ax1.legend(loc="upper left", bbox_to_anchor=(1.15, 1), borderaxespad=0.0)
+
+    # Adjust secondary axis legend (inside the plot)
+    ax2.legend(loc="upper right")
+
+    plt.tight_layout(rect=[0, 0, 0.85, 1])
+
+    plot_stream = BytesIO()
+    plt.savefig(plot_stream, format="png", bbox_inches="tight")
+    plot_stream.seek(0)
+    plt.close()
+
+    return plot_stream
+
+
 def create_image_and_captions(df):
     images_and_captions = []
 
     df["daily"] = pd.to_numeric(df["daily"], errors="coerce")
 
-    current_year = datetime.now().year
-    start_year = current_year - 6
+    this_year = current_year()
+    start_year = this_year - 6
     df = df[df["date"].dt.year >= start_year]
+    latest_date = df["date"].max()
 
     # Set the date as the index
-    df.set_index("date", inplace=True)
-
-    markers = itertools.cycle(("+", "o", "*", "s", "x", "D", "^"))
-    line_styles = itertools.cycle((":", "-.", "-"))
-
-    cmap = plt.get_cmap("gnuplot2")
+    df = df.set_index("date")
+    hospitals = df["hospital"].unique()
 
     for year in df.index.year.unique():
-        if str(year) == str(datetime.now().year):
+        if year == this_year:
             continue
-        plt.figure(figsize=(16, 8))
-
-        # Create the primary y-axis
-        ax1 = plt.gca()
-        ax1.set_ylabel("Blood Donations (Normal Range)")
 
-        # Create the secondary y-axis
-        ax2 = ax1.twinx()
-        ax2.set_ylabel("Blood Donations (Large Range)")
-
-        num_hospitals = len(df["hospital"].unique())
+        # Closed years are rendered once and then served from the archive
+        archived = load_year(year)
+        if archived is not None:
+            plot, caption = archived
+            images_and_captions.append([BytesIO(plot), caption])
+            continue
 
+        yearly_data = df[df.index.year == year]
         caption = create_message(df, year)
+        monthly_sums = (
+            yearly_data.groupby("hospital")["daily"].resample("ME").sum().reset_index()
+        )
+        plot_stream = plot_year(monthly_sums, hospitals, year)
 
-        for i, hospital in enumerate(df["hospital"].unique()):
-            color_index = i / (num_hospitals - 1) * 0.85
-
-            hospital_yearly_data = df[
-                (df.index.year == year) & (df["hospital"] == hospital)
-            ]
-
-            monthly_data = hospital_yearly_data.resample("ME").sum()
-
-            # Plotting for each hospital
-            if hospital == "Pusat Darah Negara":
-                # Plot on secondary y-axis
-                ax2.plot(
-                    monthly_data.index.month,
-                    monthly_data["daily"],
-                    label=hospital + " (Large Range)",
-                    color="red",
-                    linestyle="-",
-                    marker="x",
-                )
-            else:
-                # Plot on primary y-axis
-                ax1.plot(
-                    monthly_data.index.month,
-                    monthly_data["daily"],
-                    label=hospital,
-                    color=cmap(color_index),
-                    marker=next(markers),
-                    linestyle=next(line_styles),
-                )
-
-        # Plot settings
-        plt.title(f"Monthly Blood Donations in {year}")
-        plt.xlabel("Month")
-        ax1.set_xticks(range(1, 13))  # Set x-ticks to be each month
-        ax1.grid(True)
-
-        # Adjust primary axis legend (outside the plot)
-        ax1.legend(loc="upper left", bbox_to_anchor=(1.15, 1), borderaxespad=0.0)
-
-        # Adjust secondary axis legend (inside the plot)
-        ax2.legend(loc="upper right")
-
-        plt.tight_layout(rect=[0, 0, 0.85, 1])
-
-        plot_stream = BytesIO()
-        plt.savefig(plot_stream, format="png", bbox_inches="tight")
-        plot_stream.seek(0)
-        plt.close()
+        # Only archive once the data covers the whole year, the first commit
+        # after New Year may still be missing the last days of December
+        if latest_date >= pd.Timestamp(year=year, month=12, day=31):
+            save_year(year, monthly_sums, caption, plot_stream.getvalue())
 
         images_and_captions.append([plot_stream, caption])
 
@@ -133,9 +168,9 @@ def create_image_and_captions(df):
 
 
 def retent_transform(donor_retent, year_range=None):
-    current_year = datetime.now().year
+    this_year = current_year()
     if year_range:
-        start_year = current_year - year_range
+        start_year = this_year - year_range
         recent_visits = donor_retent[donor_retent["visit_date"].dt.year >= start_year]
     else:
         recent_visits = donor_retent
@@ -150,7 +185,7 @@ def retent_transform(donor_retent, year_range=None):
 
     # Calculate current age
     frequent_donors_recent["curr_age"] = (
-        current_year - frequent_donors_recent["birth_date"]
+        this_year - frequent_donors_recent["birth_date"]
     )
 
     # Define age ranges
@@ -0,0 +1,101 @@
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import sys
+import tempfile
+
+import httpx
+
+PIPELINE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pipeline")
+
+# Reproduces the weekly report offline from a dated snapshot directory:
+#
+#   python replay.py SNAPSHOT_DIR [--date YYYY-MM-DD] [--out DIR] [--profile DIR]
+#
+# SNAPSHOT_DIR/<YYYY-MM-DD>/ holds the four MoH datasets as .csv or .parquet
+# (and optionally blood_donation_retention_2024.parquet). The snapshot goes
+# through pipeline.py exactly as in production, including validation and
+# per-dataset uploads, but against the bot app in this process. Everything
+# the bot would post to Telegram lands in --out, or in an in-memory fake API.
+
+
+async def replay(sink):
+    import bot_send
+    bot_send.set_sink(sink)
+    from bot_run import app, render_worker
+
+    sys.path.insert(0, PIPELINE_DIR)
+    import pipeline
+
+    try:
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=app), timeout=None) as client:
+            commit = await pipeline.get_latest_commit(client)
+            await pipeline.check_for_updates(client)
+    finally:
+        render_worker.shutdown()
+
+    # The dataset state is only saved once the bot has answered the trigger
+    # with a 200, and STATE_DIR starts out empty
+    if not os.path.exists(pipeline.DATASET_STATE):
+        raise SystemExit(f"Replay of {commit} did not complete, see the log above")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay the weekly report from a local snapshot.")
+    parser.add_argument("snapshot_dir")
+    parser.add_argument("--date", help="snapshot to replay (default: latest)")
+    parser.add_argument("--out", help="write messages and photos to this new or empty directory instead of an in-memory fake API")
+    parser.add_argument("--profile", help="write cProfile stats for the pipeline, the bot and every worker job here")
+    args = parser.parse_args()
+    # Output files are numbered from 001, leftovers from an earlier run would
+    # get mixed into the new one
+    if args.out and os.path.isdir(args.out) and os.listdir(args.out):
+        parser.error(f"--out directory {args.out} is not empty")
+
+    snapshot_date = args.date or sorted(
+        entry for entry in os.listdir(args.snapshot_dir)
+        if os.path.isdir(os.path.join(args.snapshot_dir, entry))
+    )[-1]
+    snapshot = os.path.join(args.snapshot_dir, snapshot_date)
+
+    # Set before bot_run is imported and before the worker is spawned so both
+    # processes see the same pinned date and paths
+    os.environ["REPORT_DATE"] = snapshot_date
+    os.environ["SNAPSHOT_DIR"] = args.snapshot_dir
+    os.environ["SNAPSHOT_DATE"] = snapshot_date
+    os.environ["BOT_API_URL"] = "http://telebot/etl/"
+    os.environ.setdefault("GROUP_CHAT_ID", "replay")
+    retention_path = os.path.join(snapshot, "blood_donation_retention_2024.parquet")
+    if os.path.exists(retention_path):
+        os.environ["RETENTION_PATH"] = retention_path
+    if args.profile:
+        os.makedirs(args.profile, exist_ok=True)
+        os.environ["PROFILE_DIR"] = args.profile
+
+    from sinks import DirectorySink, FakeTelegramSink
+    sink = DirectorySink(args.out) if args.out else FakeTelegramSink()
+
+    # Fresh pipeline state so the snapshot always counts as a new commit, and
+    # unless ARCHIVE_DIR is given a fresh yearly archive so the replay does
+    # not depend on earlier runs
+    with contextlib.ExitStack() as stack:
+        os.environ["STATE_DIR"] = stack.enter_context(tempfile.TemporaryDirectory(prefix="replay-state-"))
+        if "ARCHIVE_DIR" not in os.environ:
+            os.environ["ARCHIVE_DIR"] = stack.enter_context(tempfile.TemporaryDirectory(prefix="yearly_archive-"))
+        if args.profile:
+            import cProfile
+            profiler = cProfile.Profile()
+            profiler.runcall(asyncio.run, replay(sink))
+            profiler.dump_stats(os.path.join(args.profile, "replay.prof"))
+        else:
+            asyncio.run(replay(sink))
+
+    if isinstance(sink, FakeTelegramSink):
+        for sent in sink.sent:
+            logging.info(f"{sent['method']}: {sent.get('text') or sent.get('caption')!r}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import matplotlib
+
+matplotlib.use("Agg")
+
+import pandas as pd
+from io import StringIO
+
+from process import create_image_and_captions, retent_transform
+from weekly_process import donation_amnt, donation_by_state, regular_donation_by_state, donation_by_facility
+from anomaly import anomaly_message
+
+# Jobs executed inside the render worker. They take the raw JSON from the
+# pipeline and return [png_bytes, caption] pairs (plus the alert text) so
+# only bytes and strings cross the process boundary.
+
+
+def _to_bytes(image_and_caption):
+    image, caption = image_and_caption
+    return [image.getvalue(), caption]
+
+
+def _read_dataset(data_json):
+    df = pd.read_json(StringIO(data_json), orient="records")
+    df['date'] = pd.to_datetime(df['date'])
+    return df
+
+
+def retention_report(parquet_path):
+    donor_retent = pd.read_parquet(parquet_path, engine='pyarrow')
+    donor_retent['visit_date'] = pd.to_datetime(donor_retent['visit_date'])
+    donor_retent['birth_date'] = donor_retent['birth_date'].astype(int)
+
+    results = [_to_bytes(retent_transform(donor_retent))]
+    for year_range in [5, 1]: # send past 5 years trend and past year trend
+        results.append(_to_bytes(retent_transform(donor_retent, year_range)))
+    return results
+
+
+def _facility_images(donate_fac):
+    latest_date = donate_fac['date'].max()
+    prev_week = latest_date - pd.Timedelta(days=6)
+    this_weeks_data = donate_fac[(donate_fac['date'] >= prev_week) &
+                                        (donate_fac['date'] <= latest_date)].copy()
+
+    results = [_to_bytes(image_and_caption) for image_and_caption in create_image_and_captions(donate_fac)]
+    results.append(_to_bytes(donation_by_facility(this_weeks_data)))
+    return results
+
+
+def _state_images(donate_state):
+    return [
+        _to_bytes(donation_amnt(donate_state)),
+        _to_bytes(donation_by_state(donate_state)),
+        _to_bytes(regular_donation_by_state(donate_state)),
+    ]
+
+
+def weekly_report(donate_fac_json, donate_state_json):
+    # One job so each dataset is parsed once for both the plots and the alerts
+    donate_fac = _read_dataset(donate_fac_json)
+    donate_state = _read_dataset(donate_state_json)
+
+    images_and_captions = _facility_images(donate_fac) + _state_images(donate_state)
+    return images_and_captions, anomaly_message(donate_state, donate_fac)
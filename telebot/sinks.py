@@ -0,0 +1,80 @@
+import os
+import httpx
+
+
+def _as_bytes(photo):
+    return photo.getvalue() if hasattr(photo, "getvalue") else photo
+
+
+class TelegramSink:
+    def __init__(self, api_url):
+        self.api_url = api_url
+
+    async def send_message(self, chat_id, text):
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"{self.api_url}/sendMessage", json={"chat_id": chat_id, "text": text}
+            )
+            response.raise_for_status()
+
+    async def send_photo(self, chat_id, photo, caption=None):
+        files = {"photo": ("plot.png", photo)}
+        json_msg = {"chat_id": chat_id}
+
+        if caption:
+            json_msg["caption"] = caption
+
+        async with httpx.AsyncClient() as client:
+            response = await client.post(
+                f"{self.api_url}/sendPhoto", data=json_msg, files=files
+            )
+            response.raise_for_status()
+
+
+# In-process stand-in for the Telegram API, keeps everything that was sent
+class FakeTelegramSink:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id, text):
+        self.sent.append({"method": "sendMessage", "chat_id": chat_id, "text": text})
+
+    async def send_photo(self, chat_id, photo, caption=None):
+        self.sent.append(
+            {"method": "sendPhoto", "chat_id": chat_id, "photo": _as_bytes(photo), "caption": caption}
+        )
+
+
+# Writes every message and photo to numbered files so a replayed run can be diffed
+class DirectorySink:
+    def __init__(self, path):
+        self.path = path
+        self.count = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _next_name(self, kind):
+        self.count += 1
+        return os.path.join(self.path, f"{self.count:03d}-{kind}")
+
+    async def send_message(self, chat_id, text):
+        with open(f"{self._next_name('message')}.txt", "w") as file:
+            file.write(text)
+
+    async def send_photo(self, chat_id, photo, caption=None):
+        name = self._next_name("photo")
+        with open(f"{name}.png", "wb") as file:
+            file.write(_as_bytes(photo))
+        if caption:
+            with open(f"{name}.txt", "w") as file:
+                file.write(caption)
+
+
+def make_sink(spec, api_url):
+    # TELEGRAM_SINK: unset for the real API, "fake" or "dir:<path>" for replays
+    if not spec:
+        return TelegramSink(api_url)
+    if spec == "fake":
+        return FakeTelegramSink()
+    if spec.startswith("dir:"):
+        return DirectorySink(spec[len("dir:"):])
+    raise ValueError(f"Unknown TELEGRAM_SINK: {spec}")
@@ -0,0 +1,87 @@
+import asyncio
+import importlib
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+MAX_JOBS_PER_WORKER = int(os.environ.get("WORKER_MAX_JOBS", 20))
+MAX_WORKER_RSS_MB = int(os.environ.get("WORKER_MAX_RSS_MB", 1024))
+PROFILE_DIR = os.environ.get("PROFILE_DIR")
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        import resource
+        # Peak rather than current RSS, but good enough as a recycling signal
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def _run_job(job, args):
+    # Jobs are resolved by "module.function" name inside the child so the
+    # API process never has to import pandas or matplotlib itself
+    module_name, function_name = job.rsplit(".", 1)
+    fn = getattr(importlib.import_module(module_name), function_name)
+    if PROFILE_DIR:
+        import cProfile
+        profiler = cProfile.Profile()
+        result = profiler.runcall(fn, *args)
+        profiler.dump_stats(os.path.join(PROFILE_DIR, f"{function_name}-{os.getpid()}.prof"))
+    else:
+        result = fn(*args)
+    return result, current_rss_mb()
+
+
+# Analytics and plotting run in a single child process that is replaced after
+# max_jobs jobs or once its RSS passes max_rss_mb, so matplotlib and pandas
+# heap growth never accumulates in the long-lived API process.
+class RenderWorker:
+    def __init__(self, max_jobs=MAX_JOBS_PER_WORKER, max_rss_mb=MAX_WORKER_RSS_MB):
+        self.max_jobs = max_jobs
+        self.max_rss_mb = max_rss_mb
+        self._context = multiprocessing.get_context("spawn")
+        self._executor = None
+        self._jobs = 0
+        self._lock = asyncio.Lock()
+
+    def _start(self):
+        self._executor = ProcessPoolExecutor(max_workers=1, mp_context=self._context)
+        self._jobs = 0
+
+    def recycle(self, reason):
+        if self._executor is not None:
+            logging.info(f"Recycling render worker: {reason}")
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    async def run(self, job, *args):
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            for attempt in range(2):
+                if self._executor is None:
+                    self._start()
+                try:
+                    result, rss_mb = await loop.run_in_executor(self._executor, _run_job, job, args)
+                    break
+                except BrokenProcessPool as e:
+                    self.recycle(f"worker died running {job} ({e})")
+                    if attempt == 1:
+                        raise
+
+            self._jobs += 1
+            if self._jobs >= self.max_jobs:
+                self.recycle(f"{self._jobs} jobs completed")
+            elif rss_mb > self.max_rss_mb:
+                self.recycle(f"RSS {rss_mb:.0f} MB above {self.max_rss_mb} MB")
+
+            return result
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None